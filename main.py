@@ -5,6 +5,7 @@ import discord
 from discord.ext import commands
 
 from music.cog import Music
+from music.diagnostics import Diagnostics
 
 logging.basicConfig(level=logging.INFO)
 
@@ -23,4 +24,6 @@ async def on_ready():
 
 
 bot.add_cog(Music(bot))
+if getenv("DIAGNOSTICS"):
+    bot.add_cog(Diagnostics(bot))
 bot.run(getenv("TOKEN"))
@@ -0,0 +1,74 @@
+import dataclasses
+import math
+import os
+
+# Bounds of the encoding bitrate, in kbps
+MAX_BITRATE = 128
+MIN_BITRATE = 32
+
+# Host load (1-minute load average per CPU) thresholds
+MEDIUM_LOAD = 0.7
+HIGH_LOAD = 1.0
+
+# libopus compression levels, from best quality to cheapest
+FULL_COMPLEXITY = 10
+MEDIUM_COMPLEXITY = 5
+LOW_COMPLEXITY = 0
+
+# Opus sources are passed through unless they are this many times above
+# the channel bitrate, as transcoding costs CPU and loses quality
+PASSTHROUGH_TOLERANCE = 2.0
+
+
+@dataclasses.dataclass
+class EncodingSettings:
+    bitrate: int
+    complexity: int
+    passthrough: bool
+
+
+def cpu_load() -> float:
+    """Returns the 1-minute load average divided by the number of CPUs."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        # Not available on this platform
+        return 0.0
+
+
+def choose_encoding(
+    channel_bitrate: int, source_codec: str, source_bitrate: float, load: float
+) -> EncodingSettings:
+    """Picks encoding settings for a voice channel and a source.
+
+    `channel_bitrate` is in bps, as given by Discord, and `source_bitrate`
+    in kbps, 0 if unknown. Opus sources are passed through, unless they are
+    far above the channel bitrate and the host has CPU to spare. Otherwise,
+    we encode at most at the channel or source bitrate, and lower the bitrate
+    and complexity as the load increases.
+
+    The frame size stays at 20ms, as discord.py sends one packet every 20ms.
+    """
+    channel_kbps = max(channel_bitrate // 1000, 1)
+    bitrate = min(channel_kbps, MAX_BITRATE)
+    if source_bitrate:
+        bitrate = min(bitrate, math.ceil(source_bitrate))
+
+    is_opus = source_codec in ("opus", "libopus")
+    fits_channel = (
+        not source_bitrate or source_bitrate <= channel_kbps * PASSTHROUGH_TOLERANCE
+    )
+    if is_opus and (fits_channel or load >= MEDIUM_LOAD):
+        return EncodingSettings(
+            bitrate=bitrate, complexity=FULL_COMPLEXITY, passthrough=True
+        )
+
+    if load >= HIGH_LOAD:
+        (bitrate, complexity) = (bitrate // 2, LOW_COMPLEXITY)
+    elif load >= MEDIUM_LOAD:
+        (bitrate, complexity) = (bitrate * 3 // 4, MEDIUM_COMPLEXITY)
+    else:
+        complexity = FULL_COMPLEXITY
+
+    bitrate = max(bitrate, min(MIN_BITRATE, channel_kbps))
+    return EncodingSettings(bitrate=bitrate, complexity=complexity, passthrough=False)
@@ -1,15 +1,32 @@
 import asyncio
+import functools
+import io
 import logging
 import os
+import re
 import time
-from typing import Optional, cast
+from typing import List, Optional, cast
 
 import discord
 from discord.ext import commands, tasks
 from youtube_dl.utils import YoutubeDLError
 
+from .bitrate import choose_encoding, cpu_load
 from .guildstate import GuildVar
+from .local import LocalTrack
+from .outbox import ChannelOutbox
+from .paginator import paginate_queue
 from .queue import QueueError, TrackQueue
+from .resolvers import (
+    CacheResolver,
+    IndexResolver,
+    LocalMediaResolver,
+    Resolver,
+    ResolverPipeline,
+    YoutubeResolver,
+)
+from .search_index import SearchIndex
+from .serialization import QueueFormatError, dump_tracks, load_tracks
 from .utils import (
     MessageableException,
     check_bot_connected,
@@ -17,7 +34,7 @@ from .utils import (
     check_channel,
     check_voice,
 )
-from .youtube import yt_search
+from .youtube import YoutubeTrack, ytdl_format_options
 
 # Maximum idle time before the bot disconnects from channel
 MAX_IDLE_TIME = 120.0
@@ -25,6 +42,27 @@ MAX_IDLE_TIME = 120.0
 # Maximum waiting time for YT video processing
 MAX_YT_WAIT_TIME = 5
 
+# Directory where saved queues are stored, one subdirectory per guild
+QUEUE_SAVE_DIR = os.getenv("QUEUE_SAVE_DIR", "saved_queues")
+
+# Maximum size of an uploaded queue file, in bytes
+MAX_QUEUE_FILE_SIZE = 4 * 1024 * 1024
+
+QUEUE_FILE_EXTENSION = ".woolq"
+QUEUE_NAME_RE = re.compile(r"[\w-]{1,32}")
+
+# SQLite file holding the index of previously seen tracks
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search_index.sqlite3")
+
+# Directory of local media files that can be played, if any
+LOCAL_MEDIA_DIR = os.getenv("LOCAL_MEDIA_DIR")
+
+# Format selections tried when the default one fails
+ALTERNATE_FORMATS = {
+    "youtube-audio": "bestaudio/best",
+    "youtube-muxed": "best[acodec!=none]/best",
+}
+
 log = logging.getLogger(__name__)
 
 
@@ -42,8 +80,11 @@ class Music(commands.Cog):
         self.bound_channel: GuildVar[Optional[discord.TextChannel]] = GuildVar(
             lambda: None
         )
+        self.outbox: GuildVar[Optional[ChannelOutbox]] = GuildVar(lambda: None)
         self.paused_at: GuildVar[Optional[float]] = GuildVar(lambda: None)
         self.idle_since: GuildVar[Optional[float]] = GuildVar(lambda: None)
+        self.search_index = SearchIndex(SEARCH_INDEX_PATH)
+        self.resolver = ResolverPipeline(self.make_resolvers())
 
         self.check_idle.start()
 
@@ -51,78 +92,133 @@ class Music(commands.Cog):
         self, ctx: commands.Context, error: commands.CommandError
     ):
         if isinstance(error, MessageableException):
-            await ctx.send(error.message)
+            await self.send(ctx, error.message)
 
         return await super().cog_command_error(ctx, error)
 
+    async def send(
+        self,
+        ctx: commands.Context,
+        content: Optional[str] = None,
+        *,
+        wait: bool = False,
+        **kwargs,
+    ) -> Optional[discord.Message]:
+        """Sends a message, through the outbox if it goes to the bound channel.
+
+        Outbox messages are sent in the background, unless `wait` is set."""
+        outbox = self.outbox[ctx] if ctx.guild is not None else None
+        if outbox is None or outbox.channel != ctx.channel:
+            return await ctx.send(content, **kwargs)
+
+        future = outbox.send(content, **kwargs)
+        return await future if wait else None
+
     @commands.command(aliases=["p"])
     @check_channel
     @check_voice
     async def play(self, ctx: commands.Context, *, query: str):
         """Plays from either a Youtube URL or Youtube search."""
         if ctx.voice_client is None:
-            # First use: we join the channel of the command's author and bind
-            voice_channel = ctx.author.voice.channel
-            text_channel = ctx.channel
-
-            self.bound_channel[ctx] = text_channel
-            await voice_channel.connect()
-            await ctx.send(
-                f"Joined {voice_channel.mention} and bound to {text_channel.mention}."
-            )
+            await self.join(ctx)
 
         assert ctx.voice_client is not None
 
-        try:
-            search_result = await self.bot.loop.run_in_executor(
-                None, yt_search, query, ctx.author
-            )
-        except YoutubeDLError as e:
-            return await ctx.send(f"Youtube-dl error : {e}")
-
+        search_result = await self.resolver.resolve(query, ctx.author)
         if search_result is None:
-            return await ctx.send("No results found !")
+            return await self.send(ctx, "No results found !")
 
         else:
             embed = self.queue[ctx].enqueue(search_result)
-            await ctx.send(embed=embed)
+            await self.send(ctx, embed=embed)
 
         if not ctx.voice_client.is_playing():
             return await self.next_track(ctx)
 
-    async def next_track(self, ctx: commands.Context):
-        if ctx.voice_client is None:
-            return
+    def make_resolvers(self) -> List[Resolver]:
+        resolvers = [CacheResolver(), IndexResolver(self.search_index)]
+        if LOCAL_MEDIA_DIR is not None:
+            resolvers.append(LocalMediaResolver(LOCAL_MEDIA_DIR))
 
-        (track, next_track) = self.queue[ctx].next_song()
+        resolvers.append(YoutubeResolver("youtube", ytdl_format_options["format"]))
+        resolvers.extend(
+            YoutubeResolver(name, format)
+            for (name, format) in ALTERNATE_FORMATS.items()
+        )
+        return resolvers
+
+    def prepare_track(self, track: YoutubeTrack) -> None:
+        track.update_info()
+        if not isinstance(track, LocalTrack):
+            self.search_index.add([track], played=True)
+
+    async def join(self, ctx: commands.Context):
+        """Joins the channel of the command's author and binds to the text channel."""
+        voice_channel = ctx.author.voice.channel
+        text_channel = ctx.channel
+
+        self.bound_channel[ctx] = text_channel
+        previous_outbox = self.outbox[ctx]
+        if previous_outbox is not None:
+            # Left over if the voice connection was lost without a cleanup
+            previous_outbox.close()
+        self.outbox[ctx] = ChannelOutbox(text_channel)
+        await voice_channel.connect()
+        await self.send(
+            ctx, f"Joined {voice_channel.mention} and bound to {text_channel.mention}."
+        )
 
-        if track is None:
-            ctx.voice_client.stop()
-            self.queue[ctx].playing = None
+    async def next_track(self, ctx: commands.Context):
+        if ctx.voice_client is None:
             return
 
-        await self.bot.loop.run_in_executor(None, track.update_info)
-
-        embed = track.as_embed()
-        embed.title = "Now playing"
-        embed.add_field(name="Up next", value=next_track, inline=False)
+        # Tracks that cannot be played are skipped until one can
+        while True:
+            (track, next_track) = self.queue[ctx].next_song()
+
+            if track is None:
+                ctx.voice_client.stop()
+                self.queue[ctx].playing = None
+                return
+
+            outbox = self.outbox[ctx]
+            assert outbox is not None
+
+            try:
+                await self.bot.loop.run_in_executor(None, self.prepare_track, track)
+            except YoutubeDLError as e:
+                # Typically a deleted or private video in a restored queue
+                log.warning(f"Cannot play {track.id}: {e}")
+                outbox.send(f"**Can't play** `{track.title}`**, skipping it.**")
+                continue
+
+            embed = track.as_embed()
+            embed.title = "Now playing"
+            embed.add_field(name="Up next", value=next_track, inline=False)
+
+            outbox.send(embed=embed, now_playing=True)
+
+            encoding = choose_encoding(
+                cast(discord.VoiceChannel, ctx.voice_client.channel).bitrate,
+                track.acodec,
+                track.abr or 0,
+                cpu_load(),
+            )
+            player = track.as_audio(encoding)
+            log.info(f"Playing {track.url} with {encoding}")
 
-        assert self.bound_channel[ctx] is not None
-        await self.bound_channel[ctx].send(embed=embed)  # type: ignore
+            # Wait for file to be nonempty to stream (avoids premature stopping)
+            # Loses up to 1s on very slow connections...
+            t = time.time()
+            while not os.stat(player._tempfile.name).st_size:
+                time.sleep(0.01)
+                if time.time() - t > MAX_YT_WAIT_TIME:
+                    break
 
-        player = track.as_audio()
-        log.info(f"Playing {track.url}")
+            if os.stat(player._tempfile.name).st_size:
+                break
 
-        # Wait for file to be nonempty to stream (avoids premature stopping)
-        # Loses up to 1s on very slow connections...
-        t = time.time()
-        while not os.stat(player._tempfile.name).st_size:
-            time.sleep(0.01)
-            if time.time() - t > MAX_YT_WAIT_TIME:
-                await self.bound_channel[ctx].send(  # type:ignore
-                    "**Can't play the requested youtube video: link timed out**"
-                )
-                return await self.next_track(ctx)
+            outbox.send("**Can't play the requested youtube video: link timed out**")
 
         time.sleep(0.1)
 
@@ -163,10 +259,10 @@ class Music(commands.Cog):
 
         try:
             self.queue[ctx].remove(list(range(1, idx)))
-            await ctx.send(success_message)
+            await self.send(ctx, success_message)
             return await self.next_track(ctx)
         except QueueError:
-            return await ctx.send(f"**Index** `{idx}` **is not a valid song !**")
+            return await self.send(ctx, f"**Index** `{idx}` **is not a valid song !**")
 
     @commands.command()
     @check_channel
@@ -178,7 +274,7 @@ class Music(commands.Cog):
 
         ctx.voice_client.pause()
         self.paused_at[ctx] = time.time()
-        return await ctx.send("**Playback paused.**")
+        return await self.send(ctx, "**Playback paused.**")
 
     @commands.command()
     @check_channel
@@ -189,7 +285,7 @@ class Music(commands.Cog):
         assert ctx.voice_client is not None
 
         if not ctx.voice_client.is_paused():
-            return await ctx.send("**I am not paused.**")
+            return await self.send(ctx, "**I am not paused.**")
         ctx.voice_client.resume()
 
         if (
@@ -200,11 +296,15 @@ class Music(commands.Cog):
                 time.time() - self.paused_at[ctx]  # type:ignore
             )
 
-        return await ctx.send("**Playback resumed.**")
+        return await self.send(ctx, "**Playback resumed.**")
 
     async def cleanup(self, client: discord.VoiceClient):
         if client.guild is not None:
             self.bound_channel[client.guild] = None
+            outbox = self.outbox[client.guild]
+            if outbox is not None:
+                outbox.close()
+                self.outbox[client.guild] = None
             self.queue[client.guild].clear()
 
         return await client.disconnect()
@@ -219,7 +319,7 @@ class Music(commands.Cog):
         Also unbounds the bot from any text channels and clears the queue."""
         assert ctx.voice_client is not None
         await self.cleanup(ctx.voice_client)
-        return await ctx.send("**Successfully disconnected.**")
+        return await self.send(ctx, "**Successfully disconnected.**")
 
     @commands.command(name="queue")
     @check_channel
@@ -229,13 +329,20 @@ class Music(commands.Cog):
         """Displays the current queue.
 
         If an argument is given, displays the songs after the specified track.
+        Pages can be browsed with the reactions below the message.
         """
         try:
-            await ctx.send(embed=self.queue[ctx].as_embed(start=start - 1))
+            await paginate_queue(
+                self.bot,
+                functools.partial(self.send, ctx, wait=True),
+                self.queue[ctx],
+                start=start - 1,
+            )
         except QueueError:
-            await ctx.send(
+            await self.send(
+                ctx,
                 f"**Error : start index** `{start}`"
-                "** is greater than the queue length !**"
+                "** is greater than the queue length !**",
             )
 
     @commands.command()
@@ -249,16 +356,18 @@ class Music(commands.Cog):
 
             if len(removed_entries) == 1:
                 track = removed_entries[0]
-                await ctx.send(f"**Successfully removed** `{track.title}`.")
+                await self.send(ctx, f"**Successfully removed** `{track.title}`.")
             else:
-                await ctx.send(
-                    f"**Successfully removed** `{len(removed_entries)}` **tracks.**"
+                await self.send(
+                    ctx,
+                    f"**Successfully removed** `{len(removed_entries)}` **tracks.**",
                 )
         except QueueError as e:
-            await ctx.send(
+            await self.send(
+                ctx,
                 "**Invalid indices given for command `remove` : **`{}`".format(
                     ", ".join(map(str, e.args[0]))
-                )
+                ),
             )
 
     @commands.command()
@@ -268,7 +377,7 @@ class Music(commands.Cog):
     async def clear(self, ctx: commands.Context):
         """Clears the track queue."""
         self.queue[ctx].clear()
-        await ctx.send("**Queue cleared.**")
+        await self.send(ctx, "**Queue cleared.**")
 
     @commands.command()
     @check_channel
@@ -277,7 +386,135 @@ class Music(commands.Cog):
     async def shuffle(self, ctx: commands.Context):
         """Shuffles the track queue."""
         self.queue[ctx].shuffle()
-        await ctx.send("**Successfully shuffled the track queue.**")
+        await self.send(ctx, "**Successfully shuffled the track queue.**")
+
+    def saved_queue_path(self, ctx: commands.Context, name: str) -> str:
+        if QUEUE_NAME_RE.fullmatch(name) is None:
+            raise commands.BadArgument(name)
+
+        assert ctx.guild is not None
+        return os.path.join(
+            QUEUE_SAVE_DIR, str(ctx.guild.id), name + QUEUE_FILE_EXTENSION
+        )
+
+    @commands.command()
+    @check_channel
+    @check_voice
+    @check_bot_connected
+    async def save(self, ctx: commands.Context, name: str):
+        """Saves the current queue under the given name.
+
+        The currently playing track is saved at the head of the queue."""
+        try:
+            path = self.saved_queue_path(ctx, name)
+        except commands.BadArgument:
+            return await self.send(
+                ctx, "**Queue names can only contain letters, digits, `-` and `_`.**"
+            )
+
+        # Local files are not saved, see `dump_tracks`
+        tracks = [
+            t for t in self.queue[ctx].all_tracks() if not isinstance(t, LocalTrack)
+        ]
+        if not tracks:
+            return await self.send(ctx, "**The queue is empty, nothing to save.**")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(dump_tracks(tracks))
+
+        await self.send(ctx, f"**Saved** `{len(tracks)}` **tracks as** `{name}`.")
+
+    @commands.command()
+    @check_channel
+    @check_voice
+    @check_bot_connected
+    async def export(self, ctx: commands.Context):
+        """Sends the current queue as a file, which can be given to `load`."""
+        tracks = [
+            t for t in self.queue[ctx].all_tracks() if not isinstance(t, LocalTrack)
+        ]
+        if not tracks:
+            return await self.send(ctx, "**The queue is empty, nothing to export.**")
+
+        data = dump_tracks(tracks)
+        await self.send(
+            ctx,
+            f"**Exported** `{len(tracks)}` **tracks.**",
+            file=discord.File(io.BytesIO(data), "queue" + QUEUE_FILE_EXTENSION),
+        )
+
+    @commands.command()
+    @check_channel
+    @check_voice
+    async def load(self, ctx: commands.Context, name: Optional[str] = None):
+        """Adds a saved queue to the current queue.
+
+        Loads the queue saved with the given name, or the attached queue file
+        if no name is given."""
+        if name is not None:
+            try:
+                path = self.saved_queue_path(ctx, name)
+                with open(path, "rb") as f:
+                    data = f.read()
+            except (commands.BadArgument, FileNotFoundError):
+                return await self.send(ctx, f"**No saved queue named** `{name}`.")
+
+        elif ctx.message.attachments:
+            attachment = ctx.message.attachments[0]
+            if attachment.size > MAX_QUEUE_FILE_SIZE:
+                return await self.send(ctx, "**The attached queue file is too large.**")
+            data = await attachment.read()
+
+        else:
+            return await self.send(ctx, "**Give a queue name or attach a queue file.**")
+
+        assert ctx.guild is not None
+        guild = ctx.guild
+        try:
+            tracks = await self.bot.loop.run_in_executor(
+                None,
+                load_tracks,
+                data,
+                lambda user_id: guild.get_member(user_id) or self.bot.get_user(user_id),
+                ctx.author,
+            )
+        except QueueFormatError as e:
+            return await self.send(ctx, f"**Invalid queue file :** `{e}`")
+
+        if not tracks:
+            return await self.send(ctx, "**The saved queue is empty.**")
+
+        if ctx.voice_client is None:
+            await self.join(ctx)
+
+        assert ctx.voice_client is not None
+
+        self.queue[ctx].extend(tracks)
+        await self.send(ctx, f"**Loaded** `{len(tracks)}` **tracks into the queue.**")
+
+        if not ctx.voice_client.is_playing():
+            return await self.next_track(ctx)
+
+    @commands.command(name="outbox", hidden=True)
+    @commands.is_owner()
+    async def outbox_stats(self, ctx: commands.Context):
+        """Shows statistics about the messages sent to the bound channel."""
+        outbox = self.outbox[ctx]
+        if outbox is None:
+            return await ctx.send("**I am not bound to any channel.**")
+
+        await ctx.send(f"`{outbox.stats.summary()}`")
+
+    @commands.command(name="resolvers", hidden=True)
+    @commands.is_owner()
+    async def resolver_stats(self, ctx: commands.Context):
+        """Shows statistics about the track resolvers, in their current order."""
+        lines = [
+            f"{resolver.name}: {self.resolver.stats[resolver.name].summary()}"
+            for resolver in self.resolver.ordered()
+        ]
+        await ctx.send("```\n{}\n```".format("\n".join(lines)))
 
     @tasks.loop(seconds=5.0)
     async def check_idle(self):
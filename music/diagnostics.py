@@ -0,0 +1,247 @@
+import asyncio
+import collections
+import dataclasses
+import io
+import logging
+import signal
+import sys
+import threading
+import time
+import traceback
+from typing import Counter, Dict, List, Optional, Tuple
+
+import discord
+from discord.ext import commands
+
+# Interval between two event loop lag measurements
+LAG_INTERVAL = 0.25
+
+# Time without loop heartbeat after which the running callback is reported
+SLOW_CALLBACK_THRESHOLD = 0.5
+
+# Commands whose execution time is recorded
+TIMED_COMMANDS = ("play", "skip", "queue")
+
+# Sampling profiler defaults
+PROFILE_INTERVAL = 0.005
+DEFAULT_PROFILE_DURATION = 5.0
+MAX_PROFILE_DURATION = 60.0
+PROFILE_TOP_STACKS = 25
+
+log = logging.getLogger(__name__)
+
+Frame = Tuple[str, int, str]
+
+
+@dataclasses.dataclass
+class TimingStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def summary(self) -> str:
+        mean = self.total / self.count if self.count else 0.0
+        return (
+            f"{self.count} samples, {mean * 1000:.1f}ms mean, "
+            f"{self.max * 1000:.1f}ms max"
+        )
+
+
+def _thread_stack(thread_id: int) -> List[Frame]:
+    """Returns the current stack of a thread, outermost frame first."""
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return []
+
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+
+    stack.reverse()
+    return stack
+
+
+def sample_stacks(
+    thread_id: int, duration: float, interval: float = PROFILE_INTERVAL
+) -> Counter[Tuple[Frame, ...]]:
+    """Samples the stack of a thread at regular intervals.
+
+    Meant to be run in another thread than the sampled one."""
+    samples: Counter[Tuple[Frame, ...]] = collections.Counter()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        stack = _thread_stack(thread_id)
+        if stack:
+            samples[tuple(stack)] += 1
+        time.sleep(interval)
+
+    return samples
+
+
+def format_profile(samples: Counter[Tuple[Frame, ...]]) -> str:
+    """Formats samples as the most frequent leaf functions, then full stacks."""
+    total = sum(samples.values())
+    if not total:
+        return "No samples collected.\n"
+
+    leaves: Counter[Frame] = collections.Counter()
+    for (stack, count) in samples.items():
+        leaves[stack[-1]] += count
+
+    lines = [f"{total} samples\n", "Top functions (self):"]
+    for ((filename, lineno, name), count) in leaves.most_common(PROFILE_TOP_STACKS):
+        lines.append(f"{100 * count / total:6.2f}%  {name} ({filename}:{lineno})")
+
+    lines.append("\nTop stacks:")
+    for (stack, count) in samples.most_common(PROFILE_TOP_STACKS):
+        lines.append(f"{100 * count / total:6.2f}%")
+        lines.extend(
+            f"    {filename}:{lineno} in {name}" for (filename, lineno, name) in stack
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+class Diagnostics(commands.Cog):
+    """Opt-in tooling to diagnose event loop stalls."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.loop_lag = TimingStats()
+        self.slow_callbacks = 0
+        self.command_timings: Dict[str, TimingStats] = {
+            name: TimingStats() for name in TIMED_COMMANDS
+        }
+        self._command_starts: Dict[int, float] = {}
+
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+        self._stopped = threading.Event()
+        self._watchdog = threading.Thread(
+            target=self._watch_loop, name="loop-watchdog", daemon=True
+        )
+
+        bot.before_invoke(self._before_command)
+        bot.after_invoke(self._after_command)
+
+        self._lag_task = bot.loop.create_task(self._measure_lag())
+        self._watchdog.start()
+
+        try:
+            bot.loop.add_signal_handler(signal.SIGUSR1, self._profile_to_log)
+        except (NotImplementedError, AttributeError):
+            # Signals are not available on every platform
+            pass
+
+    def cog_unload(self):
+        self._stopped.set()
+        self._lag_task.cancel()
+        # discord.py has no public way to remove the global invoke hooks
+        if self.bot._before_invoke == self._before_command:
+            self.bot._before_invoke = None
+        if self.bot._after_invoke == self._after_command:
+            self.bot._after_invoke = None
+        try:
+            self.bot.loop.remove_signal_handler(signal.SIGUSR1)
+        except (NotImplementedError, AttributeError):
+            pass
+
+    async def _measure_lag(self):
+        self._loop_thread_id = threading.get_ident()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            self._heartbeat = time.monotonic()
+            self.loop_lag.record(max(0.0, self._heartbeat - start - LAG_INTERVAL))
+
+    def _watch_loop(self):
+        """Logs the stack of the event loop when it does not beat for too long."""
+        reported_heartbeat = None
+        while not self._stopped.wait(LAG_INTERVAL / 2):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - LAG_INTERVAL
+            if (
+                stalled_for < SLOW_CALLBACK_THRESHOLD
+                or heartbeat == reported_heartbeat
+                or self._loop_thread_id is None
+            ):
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            reported_heartbeat = heartbeat
+            self.slow_callbacks += 1
+            stack = "".join(traceback.format_stack(frame))
+            log.warning(
+                f"Event loop blocked for more than {stalled_for:.2f}s in:\n{stack}"
+            )
+
+    def _profile_to_log(self):
+        if self._loop_thread_id is None:
+            return
+
+        thread_id = self._loop_thread_id
+
+        def profile():
+            samples = sample_stacks(thread_id, DEFAULT_PROFILE_DURATION)
+            log.info(f"Event loop profile:\n{format_profile(samples)}")
+
+        threading.Thread(target=profile, name="loop-profiler", daemon=True).start()
+
+    async def _before_command(self, ctx: commands.Context):
+        if ctx.command is not None and ctx.command.qualified_name in TIMED_COMMANDS:
+            self._command_starts[ctx.message.id] = time.perf_counter()
+
+    async def _after_command(self, ctx: commands.Context):
+        # Also called when the command raised
+        start = self._command_starts.pop(ctx.message.id, None)
+        if start is None or ctx.command is None:
+            return
+
+        duration = time.perf_counter() - start
+        name = ctx.command.qualified_name
+        self.command_timings[name].record(duration)
+        log.debug(f"Command {name} took {duration * 1000:.1f}ms")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def diagnostics(self, ctx: commands.Context):
+        """Shows event loop lag and command timings."""
+        lines = [
+            f"Loop lag: {self.loop_lag.summary()}",
+            f"Slow callbacks: {self.slow_callbacks}",
+        ]
+        lines.extend(
+            f"{name}: {stats.summary()}"
+            for (name, stats) in self.command_timings.items()
+        )
+        await ctx.send("```\n{}\n```".format("\n".join(lines)))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def profile(
+        self, ctx: commands.Context, duration: float = DEFAULT_PROFILE_DURATION
+    ):
+        """Samples the event loop for some seconds, and sends the profile."""
+        if self._loop_thread_id is None:
+            return await ctx.send("**The event loop is not monitored yet.**")
+
+        duration = min(max(duration, 0.1), MAX_PROFILE_DURATION)
+        await ctx.send(f"**Profiling the event loop for** `{duration:.1f}s`.")
+
+        samples = await self.bot.loop.run_in_executor(
+            None, sample_stacks, self._loop_thread_id, duration
+        )
+        await ctx.send(
+            file=discord.File(
+                io.BytesIO(format_profile(samples).encode()), "profile.txt"
+            )
+        )
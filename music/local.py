@@ -0,0 +1,68 @@
+import os
+import shlex
+import subprocess
+
+from discord import User
+
+from .bitrate import EncodingSettings
+from .player import FFmpegTmpFileAudio
+from .youtube import YoutubeTrack
+
+# Extensions of the files considered as playable
+MEDIA_EXTENSIONS = (".mp3", ".ogg", ".opus", ".flac", ".wav", ".m4a", ".webm")
+
+
+def probe_duration(path: str) -> float:
+    """Returns the duration of a media file in seconds, or 0 if unknown."""
+    try:
+        output = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout
+        return float(output.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return 0.0
+
+
+class LocalTrack(YoutubeTrack):
+    """Track played from a file of the local media directory.
+
+    The `url` field holds the path of the file."""
+
+    @classmethod
+    def from_path(cls, path: str, requested_by: User) -> "LocalTrack":
+        title = os.path.splitext(os.path.basename(path))[0]
+        return cls(
+            title=title,
+            url=path,
+            duration=probe_duration(path),
+            id=path,
+            requested_by=requested_by,
+            channel="Local file",
+        )
+
+    @property
+    def markdown_link(self) -> str:
+        return f"`{self.title}`"
+
+    def update_info(self) -> None:
+        pass
+
+    def as_audio(self, encoding: EncodingSettings) -> FFmpegTmpFileAudio:
+        return FFmpegTmpFileAudio(
+            shlex.quote(self.url),
+            bitrate=encoding.bitrate,
+            complexity=encoding.complexity,
+            before_options=["-y"],
+        )
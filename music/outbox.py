@@ -0,0 +1,254 @@
+import asyncio
+import collections
+import dataclasses
+import logging
+import time
+from typing import Deque, List, Optional
+
+import discord
+
+# Time waited after the first pending message, so that bursts are sent together
+COALESCE_WINDOW = 0.3
+
+# Discord allows 5 messages every 5 seconds per channel
+RATE_LIMIT_MESSAGES = 5
+RATE_LIMIT_PERIOD = 5.0
+
+# Maximum number of pending messages, after which the oldest ones are dropped
+MAX_PENDING = 20
+
+MAX_CONTENT_LENGTH = 2000
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Proactive rate limiter, so that we never wait on a 429 backoff."""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.rate, self.tokens + (now - self.updated) * self.rate / self.per
+        )
+        self.updated = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+            self._refill()
+
+        self.tokens -= 1
+
+
+@dataclasses.dataclass
+class OutgoingMessage:
+    future: "asyncio.Future[Optional[discord.Message]]"
+    content: Optional[str] = None
+    embed: Optional[discord.Embed] = None
+    file: Optional[discord.File] = None
+    now_playing: bool = False
+    queued_at: float = dataclasses.field(default_factory=time.monotonic)
+
+
+@dataclasses.dataclass
+class OutboxStats:
+    sent: int = 0
+    edited: int = 0
+    coalesced: int = 0
+    dropped: int = 0
+    failed: int = 0
+    delivered: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    def record_latency(self, latency: float) -> None:
+        self.delivered += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def summary(self) -> str:
+        mean_latency = self.total_latency / self.delivered if self.delivered else 0.0
+        return (
+            f"{self.sent} sent, {self.edited} edited, {self.coalesced} coalesced, "
+            f"{self.dropped} dropped, {self.failed} failed - "
+            f"latency {mean_latency * 1000:.0f}ms mean, "
+            f"{self.max_latency * 1000:.0f}ms max"
+        )
+
+
+class ChannelOutbox:
+    """Outbound message queue for a bound text channel.
+
+    Messages sent in bursts are merged together: text messages are joined,
+    and put as the content of the next embed if there is one. A "Now playing"
+    message replaces the previous one if it is still the last message of the
+    channel, and supersedes any older pending one.
+    """
+
+    def __init__(self, channel: discord.TextChannel):
+        self.channel = channel
+        self.pending: Deque[OutgoingMessage] = collections.deque()
+        self.stats = OutboxStats()
+        self.now_playing_message: Optional[discord.Message] = None
+
+        self._bucket = TokenBucket(RATE_LIMIT_MESSAGES, RATE_LIMIT_PERIOD)
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.ensure_future(self._run())
+
+    def send(
+        self,
+        content: Optional[str] = None,
+        *,
+        embed: Optional[discord.Embed] = None,
+        file: Optional[discord.File] = None,
+        now_playing: bool = False,
+    ) -> "asyncio.Future[Optional[discord.Message]]":
+        """Queues a message for sending.
+
+        The returned future resolves to the message it ended up in,
+        or None if it was dropped or could not be sent."""
+        future = asyncio.get_event_loop().create_future()
+
+        if self._closed:
+            future.set_result(None)
+            return future
+
+        if self._task.done():
+            # The background task died: send directly rather than queue forever
+            return asyncio.ensure_future(self._send_directly(content, embed, file))
+
+        if now_playing:
+            self._supersede_now_playing()
+
+        while len(self.pending) >= MAX_PENDING:
+            self.pending.popleft().future.set_result(None)
+            self.stats.dropped += 1
+
+        self.pending.append(
+            OutgoingMessage(
+                future, content=content, embed=embed, file=file, now_playing=now_playing
+            )
+        )
+        self._wakeup.set()
+        return future
+
+    def close(self) -> None:
+        """Stops accepting messages, and stops once pending ones are sent."""
+        self._closed = True
+        self._wakeup.set()
+
+    def _supersede_now_playing(self) -> None:
+        for message in list(self.pending):
+            if message.now_playing:
+                self.pending.remove(message)
+                message.future.set_result(None)
+                self.stats.coalesced += 1
+
+    def _take_batch(self) -> List[OutgoingMessage]:
+        """Takes leading text messages, and the embed or file message after them."""
+        batch: List[OutgoingMessage] = []
+        length = 0
+
+        while self.pending:
+            message = self.pending[0]
+            content_length = len(message.content or "")
+            if batch and length + content_length + 1 > MAX_CONTENT_LENGTH:
+                break
+            if batch and message.file is not None:
+                break
+
+            batch.append(self.pending.popleft())
+            length += content_length + 1
+            if message.embed is not None or message.file is not None:
+                break
+
+        return batch
+
+    async def _deliver(self, batch: List[OutgoingMessage]) -> None:
+        content = "\n".join(m.content for m in batch if m.content) or None
+        last = batch[-1]
+        now_playing = last.now_playing
+
+        try:
+            result = None
+            if now_playing and self._can_edit_now_playing():
+                result = await self._edit_now_playing(content, last.embed)
+
+            if result is None:
+                result = await self.channel.send(
+                    content, embed=last.embed, file=last.file
+                )
+                self.stats.sent += 1
+                if now_playing:
+                    self.now_playing_message = result
+
+        except Exception as e:
+            log.error(f"Could not send message to {self.channel}: {e!r}")
+            self.stats.failed += len(batch)
+            result = None
+
+        self.stats.coalesced += len(batch) - 1
+        now = time.monotonic()
+        for message in batch:
+            self.stats.record_latency(now - message.queued_at)
+            if not message.future.done():
+                message.future.set_result(result)
+
+    async def _edit_now_playing(
+        self, content: Optional[str], embed: Optional[discord.Embed]
+    ) -> Optional[discord.Message]:
+        assert self.now_playing_message is not None
+        try:
+            await self.now_playing_message.edit(content=content, embed=embed)
+        except discord.HTTPException as e:
+            # Typically deleted by someone: a new message is sent instead
+            log.warning(f"Could not edit the now playing message: {e!r}")
+            self.now_playing_message = None
+            return None
+
+        self.stats.edited += 1
+        return self.now_playing_message
+
+    async def _send_directly(
+        self,
+        content: Optional[str],
+        embed: Optional[discord.Embed],
+        file: Optional[discord.File],
+    ) -> Optional[discord.Message]:
+        try:
+            result = await self.channel.send(content, embed=embed, file=file)
+        except Exception as e:
+            log.error(f"Could not send message to {self.channel}: {e!r}")
+            self.stats.failed += 1
+            return None
+
+        self.stats.sent += 1
+        return result
+
+    def _can_edit_now_playing(self) -> bool:
+        return (
+            self.now_playing_message is not None
+            and self.channel.last_message_id == self.now_playing_message.id
+        )
+
+    async def _run(self) -> None:
+        while self.pending or not self._closed:
+            if not self.pending:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            await asyncio.sleep(COALESCE_WINDOW)
+            await self._bucket.acquire()
+
+            batch = self._take_batch()
+            if batch:
+                await self._deliver(batch)
@@ -0,0 +1,87 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+import discord
+from discord.ext import commands
+
+from .queue import QUEUE_PAGE_SIZE, TrackQueue
+
+PREVIOUS_PAGE = "\N{BLACK LEFT-POINTING TRIANGLE}"
+NEXT_PAGE = "\N{BLACK RIGHT-POINTING TRIANGLE}"
+
+# Time after which the reactions stop being listened to
+PAGINATION_TIMEOUT = 120.0
+
+
+def _page_embed(queue: TrackQueue, start: int) -> discord.Embed:
+    embed = queue.as_embed(start=start)
+    embed.set_footer(text=f"Page {start // QUEUE_PAGE_SIZE + 1}/{queue.page_count()}")
+    return embed
+
+
+async def paginate_queue(
+    bot: commands.Bot,
+    send: Callable[..., Awaitable[Optional[discord.Message]]],
+    queue: TrackQueue,
+    start: int = 0,
+) -> Optional[discord.Message]:
+    """Sends the queue embed, and lets users browse it through reactions.
+
+    Turning a page edits the message instead of sending a new one.
+    Reactions are handled in the background, so that the command ends once
+    the first page is sent."""
+    message = await send(embed=_page_embed(queue, start))
+
+    if message is not None and len(queue.entries) > QUEUE_PAGE_SIZE:
+        bot.loop.create_task(_browse_queue(bot, message, queue, start))
+
+    return message
+
+
+async def _browse_queue(
+    bot: commands.Bot, message: discord.Message, queue: TrackQueue, start: int
+):
+    try:
+        for emoji in (PREVIOUS_PAGE, NEXT_PAGE):
+            await message.add_reaction(emoji)
+    except discord.HTTPException:
+        # Missing the "Add reactions" permission, or the message was deleted
+        return
+
+    def check(reaction: discord.Reaction, user: discord.User) -> bool:
+        return (
+            reaction.message.id == message.id
+            and user != bot.user
+            and str(reaction.emoji) in (PREVIOUS_PAGE, NEXT_PAGE)
+        )
+
+    while True:
+        try:
+            (reaction, user) = await bot.wait_for(
+                "reaction_add", check=check, timeout=PAGINATION_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            try:
+                await message.clear_reactions()
+            except discord.HTTPException:
+                pass
+            return
+
+        try:
+            await message.remove_reaction(reaction.emoji, user)
+        except discord.HTTPException:
+            # Missing the "Manage messages" permission: the user clicks twice
+            pass
+
+        if str(reaction.emoji) == NEXT_PAGE:
+            new_start = start + QUEUE_PAGE_SIZE
+        else:
+            new_start = max(start - QUEUE_PAGE_SIZE, 0)
+
+        if new_start >= len(queue.entries):
+            # Wraps around after the last page, or if the queue has shrunk
+            new_start = 0
+
+        if new_start != start:
+            start = new_start
+            await message.edit(embed=_page_embed(queue, start))
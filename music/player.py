@@ -21,6 +21,7 @@ class FFmpegTmpFileAudio(FFmpegAudio):
         *,
         bitrate: int = 128,
         codec: Optional[str] = None,
+        complexity: Optional[int] = None,
         executable: str = "ffmpeg",
         before_options: Optional[Union[str, List[str]]] = None,
         options: Optional[Union[str, List[str]]] = None,
@@ -54,6 +55,9 @@ class FFmpegTmpFileAudio(FFmpegAudio):
             )
         )
 
+        if complexity is not None and codec == "libopus":
+            args.append(f"-compression_level {complexity}")
+
         if isinstance(options, str):
             args.append(options)
         elif isinstance(options, list):
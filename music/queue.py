@@ -1,6 +1,6 @@
 import random
 import time
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import discord
 
@@ -8,6 +8,10 @@ from .utils import format_time
 from .youtube import YoutubePlaylist, YoutubeTrack
 
 
+# Number of tracks shown on each page of the queue embed
+QUEUE_PAGE_SIZE = 10
+
+
 class QueueError(Exception):
     pass
 
@@ -18,6 +22,15 @@ class TrackQueue:
         self.playing: Optional[YoutubeTrack] = None
         self.playing_since: Optional[float] = None
 
+        # Bumped on every change to the entries, used to invalidate cached pages
+        self.version = 0
+        self._entries_duration = 0.0
+        self._page_cache: Dict[int, str] = {}
+        self._page_cache_version = 0
+
+    def _mutated(self) -> None:
+        self.version += 1
+
     def queue_time(self) -> int:
         if self.playing is not None and self.playing_since is not None:
             track_remaining = int(
@@ -26,7 +39,7 @@ class TrackQueue:
         else:
             track_remaining = 0
 
-        return track_remaining + int(sum(entry.duration for entry in self.entries))
+        return track_remaining + int(self._entries_duration)
 
     def enqueue(self, item: Union[YoutubeTrack, YoutubePlaylist]) -> discord.Embed:
         if isinstance(item, YoutubeTrack):
@@ -38,6 +51,8 @@ class TrackQueue:
         tracks_until = len(self.entries)
         time_until = self.queue_time()
         self.entries.append(track)
+        self._entries_duration += track.duration or 0
+        self._mutated()
 
         embed = discord.Embed(
             description=track.markdown_link,
@@ -65,7 +80,7 @@ class TrackQueue:
     def enqueue_playlist(self, playlist: YoutubePlaylist) -> discord.Embed:
         time_until = self.queue_time()
         tracks_until = len(self.entries)
-        self.entries.extend(playlist.entries)
+        self.extend(playlist.entries)
 
         embed = discord.Embed(description=playlist.title)
         embed.set_author(
@@ -88,9 +103,21 @@ class TrackQueue:
 
         return embed
 
+    def extend(self, tracks: List[YoutubeTrack]) -> None:
+        self.entries.extend(tracks)
+        self._entries_duration += sum(track.duration or 0 for track in tracks)
+        self._mutated()
+
+    def all_tracks(self) -> List[YoutubeTrack]:
+        """Returns the playing track, if any, followed by the queued entries."""
+        playing = [self.playing] if self.playing is not None else []
+        return playing + self.entries
+
     def next_song(self) -> Tuple[Optional[YoutubeTrack], Optional[str]]:
         if self.entries:
             track = self.entries.pop(0)
+            self._entries_duration -= track.duration or 0
+            self._mutated()
             next_track = self.entries[0].title if self.entries else "Nothing"
             return (track, next_track)
         else:
@@ -98,6 +125,31 @@ class TrackQueue:
 
     def clear(self) -> None:
         self.entries = []
+        self._entries_duration = 0.0
+        self._mutated()
+
+    def page_count(self) -> int:
+        return max(1, -(-len(self.entries) // QUEUE_PAGE_SIZE))
+
+    def _render_page(self, start: int) -> str:
+        """Renders the "Up next" listing, cached until the queue changes."""
+        if self._page_cache_version != self.version:
+            self._page_cache.clear()
+            self._page_cache_version = self.version
+
+        if start not in self._page_cache:
+            up_next = ""
+            for (i, track) in enumerate(self.entries[start : start + QUEUE_PAGE_SIZE]):
+                up_next += "{}. {} | {} | Requested by {}".format(
+                    start + i + 1,
+                    track.markdown_link,
+                    format_time(track.duration),
+                    track.requested_by.name,
+                )
+                up_next += "\n\n"
+            self._page_cache[start] = up_next
+
+        return self._page_cache[start]
 
     def as_embed(self, start=0) -> discord.Embed:
         embed = discord.Embed(title="Current queue")
@@ -115,23 +167,14 @@ class TrackQueue:
         else:
             now_playing = "Nothing"
 
-        up_next = ""
-        for (i, track) in enumerate(self.entries[start : start + 10]):
-            up_next += "{}. {} | {} | Requested by {}".format(
-                start + i + 1,
-                track.markdown_link,
-                format_time(track.duration),
-                track.requested_by.name,
-            )
-            up_next += "\n\n"
-
+        up_next = self._render_page(start)
         num_tracks = len(self.entries)
 
         embed.description = f"""
         **Now playing:**
         {now_playing}
 
-        **Up next (showing tracks {start+1} - {start+10}):**
+        **Up next (showing tracks {start+1} - {start+QUEUE_PAGE_SIZE}):**
         {up_next}
         **{num_tracks} tracks in queue - {format_time(self.queue_time())} total length**
         """
@@ -146,8 +189,11 @@ class TrackQueue:
             removed_entries = [e for (i, e) in enumerate(self.entries) if i + 1 in args]
             new_entries = [e for (i, e) in enumerate(self.entries) if i + 1 not in args]
             self.entries = new_entries
+            self._entries_duration = sum(e.duration or 0 for e in new_entries)
+            self._mutated()
 
             return removed_entries
 
     def shuffle(self):
         random.shuffle(self.entries)
+        self._mutated()
@@ -0,0 +1,321 @@
+import abc
+import asyncio
+import collections
+import copy
+import dataclasses
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, OrderedDict, Tuple, Union
+
+import youtube_dl
+from discord import User
+
+from .local import MEDIA_EXTENSIONS, LocalTrack
+from .search_index import SearchIndex, tokenize
+from .utils import MessageableException
+from .youtube import YoutubePlaylist, YoutubeTrack, ytdl_format_options, yt_search
+
+SearchResult = Union[None, YoutubeTrack, YoutubePlaylist]
+
+# Smoothing factor of the latency moving average
+LATENCY_SMOOTHING = 0.2
+
+# A resolver slower than this many times its usual latency gets hedged
+HEDGE_LATENCY_FACTOR = 2.0
+MIN_HEDGE_DELAY = 0.1
+MAX_HEDGE_DELAY = 5.0
+
+CACHE_SIZE = 256
+CACHE_TTL = 3600.0
+
+# Interval between two scans of the local media directory
+LOCAL_MEDIA_RESCAN_INTERVAL = 60.0
+
+log = logging.getLogger(__name__)
+
+
+class ResolutionError(MessageableException):
+    message = "**Could not get this track right now, please try again later.**"
+
+
+@dataclasses.dataclass
+class ResolverStats:
+    attempts: int = 0
+    successes: int = 0
+    failures: int = 0
+    latency: float = 1.0
+
+    def record(self, latency: float, success: bool, failure: bool) -> None:
+        self.attempts += 1
+        self.successes += int(success)
+        self.failures += int(failure)
+        self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+    @property
+    def success_rate(self) -> float:
+        # Laplace smoothing, so that new resolvers are neither trusted nor banned
+        return (self.successes + 1) / (self.attempts + 2)
+
+    @property
+    def expected_cost(self) -> float:
+        return self.latency / self.success_rate
+
+    @property
+    def hedge_delay(self) -> float:
+        delay = self.latency * HEDGE_LATENCY_FACTOR
+        return min(max(delay, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+    def summary(self) -> str:
+        return (
+            f"{self.successes}/{self.attempts} found, {self.failures} failed, "
+            f"{self.latency * 1000:.0f}ms"
+        )
+
+
+class Resolver(abc.ABC):
+    """Turns a query into tracks. Resolvers are run in executor threads."""
+
+    name: str
+    # Latency estimate before the first measurement, in seconds
+    expected_latency = 1.0
+    # Whether finding nothing means that there is nothing to find
+    authoritative = False
+
+    @abc.abstractmethod
+    def resolve(self, query: str, requested_by: User) -> SearchResult:
+        pass
+
+    def learn(self, query: str, result: Union[YoutubeTrack, YoutubePlaylist]) -> None:
+        """Called with the result of the pipeline, when another resolver found it."""
+        pass
+
+
+def _with_requester(result: Any, requested_by: User) -> Any:
+    if isinstance(result, YoutubePlaylist):
+        playlist = copy.copy(result)
+        playlist.requested_by = requested_by
+        playlist.entries = [_with_requester(e, requested_by) for e in result.entries]
+        return playlist
+
+    track = copy.copy(result)
+    track.requested_by = requested_by
+    return track
+
+
+class CacheResolver(Resolver):
+    """Remembers the results of recent queries."""
+
+    name = "cache"
+    expected_latency = 0.001
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, Tuple[float, Any]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, query: str, requested_by: User) -> SearchResult:
+        key = query.strip().lower()
+        with self._lock:
+            if key not in self.entries:
+                return None
+
+            (stored_at, result) = self.entries[key]
+            if stored_at + self.ttl < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+
+        return _with_requester(result, requested_by)
+
+    def learn(self, query: str, result: Union[YoutubeTrack, YoutubePlaylist]) -> None:
+        key = query.strip().lower()
+        with self._lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class IndexResolver(Resolver):
+    """Finds previously seen tracks in the local search index."""
+
+    name = "index"
+    expected_latency = 0.005
+
+    def __init__(self, index: SearchIndex):
+        self.index = index
+
+    def resolve(self, query: str, requested_by: User) -> SearchResult:
+        return self.index.lookup(query, requested_by)
+
+    def learn(self, query: str, result: Union[YoutubeTrack, YoutubePlaylist]) -> None:
+        tracks = result.entries if isinstance(result, YoutubePlaylist) else [result]
+        self.index.add(t for t in tracks if not isinstance(t, LocalTrack))
+
+
+class LocalMediaResolver(Resolver):
+    """Finds files of a local directory whose name contains every query word."""
+
+    name = "local"
+    expected_latency = 0.01
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files: Dict[str, List[str]] = {}
+        self.scanned_at: Optional[float] = None
+
+    def _scan(self) -> None:
+        files = {}
+        for (root, _, filenames) in os.walk(self.directory):
+            for filename in filenames:
+                (_, extension) = os.path.splitext(filename)
+                if extension.lower() in MEDIA_EXTENSIONS:
+                    path = os.path.join(root, filename)
+                    relative_path = os.path.relpath(path, self.directory)
+                    files[path] = tokenize(os.path.splitext(relative_path)[0])
+
+        self.files = files
+        self.scanned_at = time.monotonic()
+
+    def resolve(self, query: str, requested_by: User) -> SearchResult:
+        if (
+            self.scanned_at is None
+            or self.scanned_at + LOCAL_MEDIA_RESCAN_INTERVAL < time.monotonic()
+        ):
+            self._scan()
+
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return None
+
+        matches = [
+            (len(tokens), path)
+            for (path, tokens) in self.files.items()
+            if all(any(t.startswith(q) for t in tokens) for q in query_tokens)
+        ]
+        if not matches:
+            return None
+
+        # The file with the fewest extra words is the most specific match
+        (_, path) = min(matches)
+        return LocalTrack.from_path(path, requested_by)
+
+
+class YoutubeResolver(Resolver):
+    """Searches Youtube, with its own format selection."""
+
+    authoritative = True
+
+    def __init__(self, name: str, format: str):
+        self.name = name
+        self.downloader = youtube_dl.YoutubeDL(
+            {**ytdl_format_options, "format": format}
+        )
+
+    def resolve(self, query: str, requested_by: User) -> SearchResult:
+        return yt_search(query, requested_by, downloader=self.downloader)
+
+
+class ResolverPipeline:
+    """Runs resolvers by increasing expected cost, until one finds something.
+
+    A resolver taking much longer than usual is raced against the next one,
+    and the first result wins. Errors are logged and the next resolver is tried.
+    """
+
+    def __init__(self, resolvers: List[Resolver]):
+        self.resolvers = resolvers
+        self.stats = {
+            r.name: ResolverStats(latency=r.expected_latency) for r in resolvers
+        }
+
+    def ordered(self) -> List[Resolver]:
+        return sorted(self.resolvers, key=lambda r: self.stats[r.name].expected_cost)
+
+    def _record(self, resolver: Resolver, started_at: float, future: asyncio.Future):
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            log.warning(f"Resolver {resolver.name} failed: {error}")
+
+        self.stats[resolver.name].record(
+            time.monotonic() - started_at,
+            success=error is None and future.result() is not None,
+            failure=error is not None,
+        )
+
+    def _learn(
+        self,
+        query: str,
+        result: Union[YoutubeTrack, YoutubePlaylist],
+        found_by: Resolver,
+    ):
+        for resolver in self.resolvers:
+            if resolver is found_by:
+                # e.g. the cache would otherwise refresh its entries on every hit
+                continue
+
+            try:
+                resolver.learn(query, result)
+            except Exception:
+                log.exception(f"Resolver {resolver.name} could not learn {query!r}")
+
+    async def resolve(self, query: str, requested_by: User) -> SearchResult:
+        loop = asyncio.get_event_loop()
+        remaining = iter(self.ordered())
+        running: Dict[asyncio.Future, Resolver] = {}
+        errors = []
+
+        def launch() -> None:
+            resolver = next(remaining, None)
+            if resolver is None:
+                return
+
+            future = loop.run_in_executor(None, resolver.resolve, query, requested_by)
+            future.add_done_callback(
+                functools.partial(self._record, resolver, time.monotonic())
+            )
+            running[future] = resolver
+
+        launch()
+        while running:
+            budget = max(self.stats[r.name].hedge_delay for r in running.values())
+            (done, _) = await asyncio.wait(
+                running, timeout=budget, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                # Latency budget exceeded: hedge with the next resolver
+                launch()
+                continue
+
+            for future in done:
+                resolver = running.pop(future)
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+
+                result = future.result()
+                if result is not None:
+                    loop.run_in_executor(None, self._learn, query, result, resolver)
+                    return result
+
+                if resolver.authoritative:
+                    return None
+
+            if not running:
+                launch()
+
+        if errors:
+            # Each error was already logged when its resolver finished
+            log.error(f"Every resolver failed for {query!r} ({len(errors)} errors)")
+            raise ResolutionError
+
+        return None
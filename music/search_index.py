@@ -0,0 +1,258 @@
+import bisect
+import collections
+import dataclasses
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import DefaultDict, Dict, Iterable, List, Optional, Set, Tuple
+
+from discord import User
+
+from .youtube import YoutubeTrack
+
+# Weight of a query token depending on how it matched a track token
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.7
+
+# Minimal token length for prefix and fuzzy matching
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+MAX_PREFIX_EXPANSIONS = 50
+
+# A local result is used only if it matches most of the query,
+# enough of its own title, and is clearly ahead of the next result
+# either on the query or on the title
+MIN_CONFIDENCE = 0.85
+MIN_TITLE_COVERAGE = 0.4
+MIN_MARGIN = 0.15
+
+_token_re = re.compile(r"\w+")
+_video_id_re = re.compile(r"[\w-]{11}")
+_url_re = re.compile(r"https?://")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases, strips accents and splits a text into words."""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(c for c in normalized if not unicodedata.combining(c))
+    return _token_re.findall(stripped)
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Checks whether two strings are at Levenshtein distance at most 1."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        (a, b) = (b, a)
+
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+
+    if len(a) == len(b):
+        return a[i + 1 :] == b[i + 1 :]
+    return a[i:] == b[i + 1 :]
+
+
+@dataclasses.dataclass
+class IndexedTrack:
+    id: str
+    title: str
+    channel: str
+    duration: float
+    thumbnail: str
+    plays: int = 0
+
+    def as_track(self, requested_by: User) -> YoutubeTrack:
+        return YoutubeTrack(
+            title=self.title,
+            url="",
+            duration=self.duration,
+            id=self.id,
+            requested_by=requested_by,
+            thumbnail=self.thumbnail,
+            channel=self.channel,
+        )
+
+
+class SearchIndex:
+    """Local index of the tracks seen so far, stored in a SQLite file.
+
+    The inverted index is kept in memory and rebuilt from the file at startup.
+    All methods are thread-safe, as they are called from executor threads.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                duration REAL NOT NULL,
+                thumbnail TEXT NOT NULL,
+                plays INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._db.commit()
+
+        self.documents: Dict[str, IndexedTrack] = {}
+        self._postings: DefaultDict[str, Set[str]] = collections.defaultdict(set)
+        self._sorted_tokens: List[str] = []
+        self._tokens_dirty = False
+
+        for row in self._db.execute(
+            "SELECT id, title, channel, duration, thumbnail, plays FROM tracks"
+        ):
+            self._index(IndexedTrack(*row))
+
+    def _index(self, document: IndexedTrack) -> None:
+        previous = self.documents.get(document.id)
+        if previous is not None:
+            for token in self._document_tokens(previous):
+                self._postings[token].discard(previous.id)
+
+        self.documents[document.id] = document
+        for token in self._document_tokens(document):
+            if not self._postings[token]:
+                self._tokens_dirty = True
+            self._postings[token].add(document.id)
+
+    @staticmethod
+    def _document_tokens(document: IndexedTrack) -> Set[str]:
+        return set(tokenize(document.title)) | set(tokenize(document.channel))
+
+    def add(self, tracks: Iterable[YoutubeTrack], played: bool = False) -> None:
+        """Adds or updates tracks in the index.
+
+        Known fields are not overwritten by empty ones, as flat playlist entries
+        carry less information than fully extracted tracks."""
+        with self._lock:
+            for track in tracks:
+                previous = self.documents.get(track.id)
+                document = IndexedTrack(
+                    id=track.id,
+                    title=track.title or (previous.title if previous else ""),
+                    channel=track.channel or (previous.channel if previous else ""),
+                    duration=track.duration or (previous.duration if previous else 0),
+                    thumbnail=track.thumbnail
+                    or (previous.thumbnail if previous else ""),
+                    plays=(previous.plays if previous else 0) + int(played),
+                )
+                if not document.title:
+                    continue
+
+                self._index(document)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)",
+                    dataclasses.astuple(document),
+                )
+
+            self._db.commit()
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """Returns the index tokens matching a query token, with their weight."""
+        if self._tokens_dirty:
+            self._sorted_tokens = sorted(
+                t for (t, ids) in self._postings.items() if ids
+            )
+            self._tokens_dirty = False
+
+        matches = {}
+        if len(token) >= MIN_PREFIX_LENGTH:
+            i = bisect.bisect_left(self._sorted_tokens, token)
+            for candidate in self._sorted_tokens[i : i + MAX_PREFIX_EXPANSIONS]:
+                if not candidate.startswith(token):
+                    break
+                matches[candidate] = PREFIX_MATCH
+
+        if len(token) >= MIN_FUZZY_LENGTH:
+            # Typos are only looked for among tokens sharing the first letter
+            start = bisect.bisect_left(self._sorted_tokens, token[0])
+            end = bisect.bisect_left(self._sorted_tokens, chr(ord(token[0]) + 1))
+            for candidate in self._sorted_tokens[start:end]:
+                if candidate not in matches and _within_one_edit(token, candidate):
+                    matches[candidate] = FUZZY_MATCH
+
+        if self._postings.get(token):
+            matches[token] = EXACT_MATCH
+
+        return list(matches.items())
+
+    def search(self, query: str) -> List[Tuple[float, float, IndexedTrack]]:
+        """Returns (query coverage, title coverage, track) tuples, best first."""
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        with self._lock:
+            # For each track and query token: best weight, and the index tokens
+            # matched with that weight
+            scores: DefaultDict[
+                str, Dict[str, Tuple[float, Set[str]]]
+            ] = collections.defaultdict(dict)
+            for query_token in query_tokens:
+                for (token, weight) in self._expand(query_token):
+                    for track_id in self._postings[token]:
+                        matched = scores[track_id]
+                        (best_weight, tokens) = matched.get(query_token, (0, set()))
+                        if weight > best_weight:
+                            matched[query_token] = (weight, {token})
+                        elif weight == best_weight:
+                            tokens.add(token)
+
+            results = []
+            for (track_id, matched) in scores.items():
+                document = self.documents[track_id]
+                title_tokens = set(tokenize(document.title))
+                total_weight = sum(weight for (weight, _) in matched.values())
+                query_coverage = total_weight / len(query_tokens)
+                # Each query token covers at most one title word, even by prefix
+                covered = sum(
+                    1 for (_, tokens) in matched.values() if tokens & title_tokens
+                )
+                title_coverage = min(covered, len(title_tokens)) / max(
+                    len(title_tokens), 1
+                )
+                results.append((query_coverage, title_coverage, document))
+
+        results.sort(key=lambda r: (r[0], r[1], r[2].plays), reverse=True)
+        return results
+
+    def lookup(self, query: str, requested_by: User) -> Optional[YoutubeTrack]:
+        """Resolves a query locally, if a known track matches it with confidence."""
+        query = query.strip()
+        if _url_re.match(query):
+            return None
+
+        if _video_id_re.fullmatch(query) and query in self.documents:
+            document = self.documents[query]
+
+        else:
+            results = self.search(query)
+            if not results:
+                return None
+
+            (confidence, title_coverage, document) = results[0]
+            if confidence < MIN_CONFIDENCE or title_coverage < MIN_TITLE_COVERAGE:
+                return None
+
+            if len(results) > 1:
+                (next_confidence, next_title_coverage, _) = results[1]
+                if (
+                    confidence - next_confidence < MIN_MARGIN
+                    and title_coverage - next_title_coverage < MIN_MARGIN
+                ):
+                    # Several tracks match as well: let Youtube decide
+                    return None
+
+        if not document.duration:
+            # Only seen in a flat playlist: not enough information to enqueue
+            return None
+
+        return document.as_track(requested_by)
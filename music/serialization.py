@@ -0,0 +1,132 @@
+import struct
+import zlib
+from typing import Callable, Iterable, List, Optional
+
+from discord import User
+
+from .local import LocalTrack
+from .youtube import YoutubeTrack
+
+# File layout: a fixed header followed by a zlib-compressed body of packed entries.
+# Each entry is a video ID, a duration, a requester ID and the title/channel,
+# which is all we need to display a queue without asking Youtube for anything.
+MAGIC = b"WOOQ"
+FORMAT_VERSION = 1
+
+_header = struct.Struct(">4sBI")  # magic, version, number of entries
+_entry = struct.Struct(">IQ")  # duration in seconds, requester ID
+
+# Upper bound on the number of entries we accept, to avoid loading garbage
+MAX_ENTRIES = 100_000
+
+# Largest possible packed entry, and upper bound on the decompressed body,
+# so that a small file cannot inflate into gigabytes
+MAX_ENTRY_SIZE = (1 + 255) + _entry.size + (2 + 65535) + (1 + 255)
+MAX_BODY_SIZE = 32 * 1024 * 1024
+
+
+class QueueFormatError(Exception):
+    pass
+
+
+def _pack_str(value: str, length_format: str) -> bytes:
+    raw = value.encode("utf-8")
+    max_length = 2 ** (8 * struct.calcsize(length_format)) - 1
+    raw = raw[:max_length]
+    return struct.pack(length_format, len(raw)) + raw
+
+
+def _unpack_str(data: bytes, offset: int, length_format: str):
+    size = struct.calcsize(length_format)
+    (length,) = struct.unpack_from(length_format, data, offset)
+    offset += size
+    raw = data[offset : offset + length]
+    if len(raw) != length:
+        raise QueueFormatError("Truncated entry")
+
+    return raw.decode("utf-8", errors="replace"), offset + length
+
+
+def dump_tracks(tracks: Iterable[YoutubeTrack]) -> bytes:
+    """Packs tracks into the binary queue format.
+
+    Local files are skipped, as they may not exist where the queue is loaded."""
+    body = bytearray()
+    count = 0
+    for track in tracks:
+        if isinstance(track, LocalTrack):
+            continue
+
+        body += _pack_str(track.id, ">B")
+        body += _entry.pack(int(track.duration or 0), track.requested_by.id)
+        body += _pack_str(track.title, ">H")
+        body += _pack_str(track.channel, ">B")
+        count += 1
+
+    return _header.pack(MAGIC, FORMAT_VERSION, count) + zlib.compress(body)
+
+
+def load_tracks(
+    data: bytes,
+    resolve_user: Callable[[int], Optional[User]],
+    default_user: User,
+) -> List[YoutubeTrack]:
+    """Unpacks tracks from the binary queue format.
+
+    No network call is made: stream URLs are fetched by `update_info` when the
+    track is about to play. Requesters that cannot be resolved are replaced
+    by `default_user`.
+    """
+    if len(data) < _header.size:
+        raise QueueFormatError("File is too short")
+
+    (magic, version, count) = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise QueueFormatError("Not a queue file")
+    if version != FORMAT_VERSION:
+        raise QueueFormatError(f"Unsupported format version {version}")
+    if count > MAX_ENTRIES:
+        raise QueueFormatError(f"Too many entries ({count})")
+    if count == 0:
+        # A limit of 0 would mean no limit to the decompressor
+        return []
+
+    max_body_size = min(count * MAX_ENTRY_SIZE, MAX_BODY_SIZE)
+    decompressor = zlib.decompressobj()
+    try:
+        body = decompressor.decompress(data[_header.size :], max_body_size)
+    except zlib.error:
+        raise QueueFormatError("Corrupted file")
+
+    if decompressor.unconsumed_tail:
+        raise QueueFormatError("File is larger than its entries")
+
+    users = {}
+    tracks = []
+    offset = 0
+    try:
+        for _ in range(count):
+            (video_id, offset) = _unpack_str(body, offset, ">B")
+            (duration, user_id) = _entry.unpack_from(body, offset)
+            offset += _entry.size
+            (title, offset) = _unpack_str(body, offset, ">H")
+            (channel, offset) = _unpack_str(body, offset, ">B")
+
+            if user_id not in users:
+                users[user_id] = resolve_user(user_id) or default_user
+
+            tracks.append(
+                YoutubeTrack(
+                    title=title,
+                    url="",
+                    duration=duration,
+                    id=video_id,
+                    requested_by=users[user_id],
+                    thumbnail=f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+                    channel=channel,
+                )
+            )
+    except struct.error:
+        raise QueueFormatError("Truncated entry")
+
+    return tracks
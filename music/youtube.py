@@ -5,6 +5,7 @@ import youtube_dl
 from discord import Embed, User
 from youtube_dl.utils import YoutubeDLError
 
+from .bitrate import EncodingSettings
 from .player import FFmpegTmpFileAudio
 from .utils import format_time
 
@@ -45,6 +46,7 @@ class BaseYoutubeTrack:
     thumbnail: str = ""
     channel: str = ""
     acodec: str = ""
+    abr: float = 0.0
 
     @property
     def markdown_link(self) -> str:
@@ -53,6 +55,9 @@ class BaseYoutubeTrack:
 
 
 class YoutubeTrack(BaseYoutubeTrack):
+    # Extractor used to refresh the track, set by the resolver that found it
+    downloader: youtube_dl.YoutubeDL = ytdl
+
     def __init__(self, *args, **kwargs):
         fields = [field.name for field in dataclasses.fields(self)]
         filtered_kwargs = {
@@ -62,15 +67,19 @@ class YoutubeTrack(BaseYoutubeTrack):
         super().__init__(*args, **filtered_kwargs)
 
     def update_info(self) -> None:
-        new_info = ytdl.extract_info(self.id, ie_key="Youtube")
+        new_info = self.downloader.extract_info(self.id, ie_key="Youtube")
         if new_info is None:
             raise YoutubeDLError("Cannot update track information")
 
         self.__init__(**new_info, requested_by=self.requested_by)
 
-    def as_audio(self) -> FFmpegTmpFileAudio:
+    def as_audio(self, encoding: EncodingSettings) -> FFmpegTmpFileAudio:
         return FFmpegTmpFileAudio(
-            self.url, codec=self.acodec, before_options=ffmpeg_options
+            self.url,
+            bitrate=encoding.bitrate,
+            codec=self.acodec if encoding.passthrough else None,
+            complexity=encoding.complexity,
+            before_options=ffmpeg_options,
         )
 
     def as_embed(self) -> Embed:
@@ -89,19 +98,26 @@ class YoutubePlaylist:
     entries: List[YoutubeTrack]
     requested_by: User
 
-    def __init__(self, ytdl_info: Dict[str, Any], requested_by: User) -> None:
+    def __init__(
+        self,
+        ytdl_info: Dict[str, Any],
+        requested_by: User,
+        downloader: youtube_dl.YoutubeDL = ytdl,
+    ) -> None:
         self.title = ytdl_info["title"]
         entries = ytdl_info["entries"]
         self.entries = [
             YoutubeTrack(**info, requested_by=requested_by) for info in entries
         ]
+        for entry in self.entries:
+            entry.downloader = downloader
         self.requested_by = requested_by
 
 
 def yt_search(
-    query: str, requested_by: User
+    query: str, requested_by: User, downloader: youtube_dl.YoutubeDL = ytdl
 ) -> Union[None, YoutubeTrack, YoutubePlaylist]:
-    data = ytdl.extract_info(query)
+    data = downloader.extract_info(query)
 
     if data is None:
         return None
@@ -111,16 +127,21 @@ def yt_search(
         results = data.get("entries", [])
         if len(results):
             track = YoutubeTrack(**results[0], requested_by=requested_by)
+            track.downloader = downloader
             track.update_info()
             return track
         else:
             return None
 
     elif data.get("_type") == "playlist":
-        playlist = YoutubePlaylist(data, requested_by=requested_by)
+        playlist = YoutubePlaylist(
+            data, requested_by=requested_by, downloader=downloader
+        )
         # We process the first entry, for thumbnail purposes
         playlist.entries[0].update_info()
         return playlist
 
     else:
-        return YoutubeTrack(**data)
+        track = YoutubeTrack(**data, requested_by=requested_by)
+        track.downloader = downloader
+        return track